@@ -2,33 +2,47 @@
 # To run this backend, save it as `main.py` and run the command:
 # uvicorn main:app --reload
 # Ensure you have all dependencies installed:
-# pip install fastapi uvicorn python-multipart Pillow pandas torch transformers sentencepiece word2number thefuzz
+# pip install fastapi uvicorn python-multipart Pillow pandas torch transformers sentencepiece word2number rapidfuzz aiofiles orjson
 
 import uvicorn
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+import asyncio
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, ORJSONResponse
 from pydantic import BaseModel
 from PIL import Image
 import pandas as pd
+import numpy as np
 import warnings
 import os
+import sys
 import torch
 import re
-import json
+import copy
+import functools
+import orjson
 import io
+import csv
+import hashlib
+import aiofiles
+from collections import deque
 from datetime import datetime, date, timedelta
 from typing import Optional, List
 from word2number import w2n
-from thefuzz import process as fuzzy_process
+from rapidfuzz import process as fuzzy_process, fuzz
 
 
 # Import transformers if available
 try:
-    from transformers import pipeline, ViTForImageClassification, ViTImageProcessor
+    from transformers import (
+        pipeline, ViTForImageClassification, ViTImageProcessor,
+        AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig,
+    )
 except ImportError:
     print("WARNING: `transformers` library not found. AI features will not work.")
     ViTForImageClassification = ViTImageProcessor = pipeline = None
+    AutoModelForCausalLM = AutoTokenizer = BitsAndBytesConfig = None
 
 # --- Suppress Warnings ---
 warnings.filterwarnings("ignore")
@@ -37,32 +51,182 @@ warnings.filterwarnings("ignore")
 BASE_VIT_MODEL = "google/vit-base-patch16-224"
 FINETUNED_VIT_PATH = "./finetuned" 
 NUTRITION_DATA_PATH = './ULTIMATE_NUTRITION_DATABASE.csv'
+NUTRITION_PARQUET_PATH = './ULTIMATE_NUTRITION_DATABASE.parquet'
+NUTRITION_DTYPES = {'Food_Item': 'string', 'Calories': 'float32', 'Protein_g': 'float32', 'Fat_g': 'float32', 'Carbs_g': 'float32'}
 TINYLLAMA_MODEL = "./text-model"
-MEAL_LOG_FILE = "meal_log.json"
-FEEDBACK_LOG_FILE = "feedback_log.json"
+VIT_FP32_ONNX_PATH = "./vit_fp32.onnx"
+VIT_INT8_ONNX_PATH = "./vit_int8.onnx"
+MEAL_LOG_FILE = "meal_log.jsonl"
+FEEDBACK_LOG_FILE = "feedback_log.jsonl"
+
+# Constant prompt prefixes whose KV caches are prefilled once at model load,
+# so per-request prefill only covers the variable suffix.
+DAILY_TIP_PROMPT = "<|system|>You are a friendly health assistant. Provide a single, actionable, positive health tip. Keep it short.</s><|user|>Give me a simple health tip for today.</s><|assistant|>"
+SUMMARY_PREFIX = """
+    <|system|>
+    You are NutriGuide, a friendly AI nutritionist. Analyze the user's meal history and provide a helpful summary. Look for patterns, provide at least two clear, actionable suggestions. Be positive and conversational. Speak directly to the user.</s>
+    <|user|>
+    My recent meal history:
+"""
 
 # --- 2. Initialize FastAPI App & AI Models ---
-app = FastAPI(title="NutriGuide API")
+app = FastAPI(title="NutriGuide API", default_response_class=ORJSONResponse)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"], allow_credentials=True,
     allow_methods=["*"], allow_headers=["*"],
 )
 
+def export_vit_int8_onnx():
+    """Offline step (run once via `python main.py --export-vit`): export the
+    fine-tuned ViT to ONNX and INT8-quantize it for the TensorRT path."""
+    from modelopt.onnx.quantization import quantize
+    model = ViTForImageClassification.from_pretrained(FINETUNED_VIT_PATH)
+    model.eval()
+    dummy = torch.zeros(1, 3, 224, 224)
+    torch.onnx.export(
+        model, dummy, VIT_FP32_ONNX_PATH,
+        input_names=["pixel_values"], output_names=["logits"],
+        dynamic_axes={"pixel_values": {0: "batch"}, "logits": {0: "batch"}},
+        opset_version=17,
+    )
+    quantize(
+        onnx_path=VIT_FP32_ONNX_PATH, quantize_mode="int8",
+        high_precision_dtype="fp16", op_types_to_exclude=["Add"],
+        output_path=VIT_INT8_ONNX_PATH,
+    )
+    print(f"✅ INT8 ViT exported to '{VIT_INT8_ONNX_PATH}'.")
+
+
+class TRTViTClassifier:
+    """Thin pipeline-compatible callable that runs the INT8 ONNX ViT through
+    a TensorRT engine on a persistent CUDA stream."""
+
+    def __init__(self, engine, processor, id2label, input_dtype, output_dtype, top_k=5):
+        self.engine = engine
+        self.context = engine.create_execution_context()
+        self.processor = processor
+        self.id2label = id2label
+        self.top_k = top_k
+        self.stream = torch.cuda.Stream()
+        self.input_name = engine.get_tensor_name(0)
+        self.output_name = engine.get_tensor_name(1)
+        # With high_precision_dtype="fp16" the engine I/O may be fp16, so the
+        # buffer dtypes come from the engine rather than defaulting to fp32.
+        self.input_dtype = input_dtype
+        self.output_dtype = output_dtype
+
+    def __call__(self, images, batch_size=None):
+        # Mirror the HF pipeline contract: a list input returns one
+        # prediction list per image. batch_size is accepted for pipeline
+        # parity; the engine always runs the whole batch in one pass.
+        batched = isinstance(images, list)
+        pixels = self.processor(images, return_tensors="pt")["pixel_values"].to(device="cuda", dtype=self.input_dtype)
+        logits = torch.empty((pixels.shape[0], len(self.id2label)), dtype=self.output_dtype, device="cuda")
+        self.context.set_input_shape(self.input_name, tuple(pixels.shape))
+        self.context.set_tensor_address(self.input_name, pixels.data_ptr())
+        self.context.set_tensor_address(self.output_name, logits.data_ptr())
+        self.context.execute_async_v3(self.stream.cuda_stream)
+        self.stream.synchronize()
+        scores, idx = logits.float().softmax(-1).topk(self.top_k)
+        results = [
+            [{"label": self.id2label[int(i)], "score": float(s)} for s, i in zip(srow, irow)]
+            for srow, irow in zip(scores, idx)
+        ]
+        return results if batched else results[0]
+
+
+def build_trt_vit_classifier(processor, id2label):
+    import tensorrt as trt
+    logger = trt.Logger(trt.Logger.WARNING)
+    builder = trt.Builder(logger)
+    network = builder.create_network(1 << int(trt.NetworkDefinitionCreationFlag.EXPLICIT_BATCH))
+    parser = trt.OnnxParser(network, logger)
+    with open(VIT_INT8_ONNX_PATH, 'rb') as f:
+        if not parser.parse(f.read()):
+            raise RuntimeError(f"Failed to parse '{VIT_INT8_ONNX_PATH}'.")
+    config = builder.create_builder_config()
+    config.set_flag(trt.BuilderFlag.INT8)
+    config.set_flag(trt.BuilderFlag.FP16)
+    # The ONNX batch axis is dynamic; TensorRT refuses to build without an
+    # optimization profile covering the shapes the micro-batcher can emit.
+    profile = builder.create_optimization_profile()
+    profile.set_shape(network.get_input(0).name,
+                      (1, 3, 224, 224), (VIT_MAX_BATCH, 3, 224, 224), (VIT_MAX_BATCH, 3, 224, 224))
+    config.add_optimization_profile(profile)
+    serialized = builder.build_serialized_network(network, config)
+    if serialized is None:
+        raise RuntimeError("TensorRT engine build failed.")
+    engine = trt.Runtime(logger).deserialize_cuda_engine(serialized)
+    trt_to_torch = {trt.DataType.FLOAT: torch.float32, trt.DataType.HALF: torch.float16}
+    return TRTViTClassifier(
+        engine, processor, id2label,
+        input_dtype=trt_to_torch.get(engine.get_tensor_dtype(engine.get_tensor_name(0)), torch.float32),
+        output_dtype=trt_to_torch.get(engine.get_tensor_dtype(engine.get_tensor_name(1)), torch.float32),
+    )
+
+
 class AIModels:
     def __init__(self):
         self.vit_classifier = None
         self.nutrition_df = None
-        self.text_generator = None
+        self.text_model = None
+        self.text_tokenizer = None
+        self._tip_prefix_kv = None
+        self._summary_prefix_kv = None
         self.food_list_for_fuzzy_search = []
+        self.food_names_norm = ()
+        self.nutrition_index = {}
+        self.food_id = {}
+        self.meal_log_cache = []
+        self._meal_log_size = -1
+        # Single in-flight GPU call: concurrent batches would OOM or
+        # thrash the cache. Shared by the ViT and TinyLlama paths.
+        self._gpu_sem = asyncio.Semaphore(1)
         self.load_models()
 
     def load_models(self):
         if pipeline and os.path.isdir(FINETUNED_VIT_PATH):
             try:
                 processor = ViTImageProcessor.from_pretrained(FINETUNED_VIT_PATH)
-                model = ViTForImageClassification.from_pretrained(FINETUNED_VIT_PATH)
-                self.vit_classifier = pipeline(task="image-classification", model=model, image_processor=processor)
+                if torch.cuda.is_available():
+                    # Half-precision ViT beats INT8 on most NVIDIA GPUs;
+                    # BF16 on Ampere+ gets ~2x FP32 TensorCore throughput.
+                    vit_dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+                    model = ViTForImageClassification.from_pretrained(FINETUNED_VIT_PATH, torch_dtype=vit_dtype)
+                    if os.path.exists(VIT_INT8_ONNX_PATH):
+                        try:
+                            self.vit_classifier = build_trt_vit_classifier(processor, model.config.id2label)
+                            print("✅ ViT INT8 TensorRT engine built successfully.")
+                        except Exception as e:
+                            print(f"⚠️ WARNING: Could not build TensorRT engine, falling back to FP16. Error: {e}")
+                    if self.vit_classifier is None:
+                        model = model.to("cuda")
+                        try:
+                            # reduce-overhead captures CUDA graphs, removing
+                            # per-op Python dispatch and launch overhead.
+                            compiled = torch.compile(model, mode="reduce-overhead", fullgraph=True)
+                            with torch.no_grad():
+                                # The pipeline feeds fp32 pixel_values (ViT
+                                # casts to the weight dtype internally) and
+                                # dynamo guards on dtype and shape, so warm
+                                # every batch size the micro-batcher can emit
+                                # or the first live request of each size pays
+                                # the compile + graph-capture stall.
+                                for batch in range(1, VIT_MAX_BATCH + 1):
+                                    compiled(torch.zeros(batch, 3, 224, 224, dtype=torch.float32, device="cuda"))
+                            model = compiled
+                            print("✅ ViT compiled with torch.compile(reduce-overhead).")
+                        except Exception as e:
+                            print(f"⚠️ WARNING: torch.compile failed, running eager. Error: {e}")
+                        self.vit_classifier = pipeline(task="image-classification", model=model, image_processor=processor, device=0)
+                else:
+                    # Dynamic INT8 on the linear layers roughly halves CPU
+                    # latency with <1% accuracy loss.
+                    model = ViTForImageClassification.from_pretrained(FINETUNED_VIT_PATH)
+                    model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+                    torch.set_num_threads(os.cpu_count())
+                    self.vit_classifier = pipeline(task="image-classification", model=model, image_processor=processor)
                 print("✅ ViT model loaded successfully.")
             except Exception as e:
                 print(f"⚠️ WARNING: Could not load ViT model. Error: {e}")
@@ -70,53 +234,216 @@ class AIModels:
             print(f"⚠️ WARNING: ViT model directory not found at '{FINETUNED_VIT_PATH}'.")
 
         try:
-            self.nutrition_df = pd.read_csv(NUTRITION_DATA_PATH)
-            self.nutrition_df['Food_Item_Lower'] = self.nutrition_df['Food_Item'].str.lower().str.strip()
             nutritional_cols = ['Calories', 'Protein_g', 'Fat_g', 'Carbs_g']
-            for col in nutritional_cols:
-                self.nutrition_df[col] = pd.to_numeric(self.nutrition_df[col], errors='coerce')
+            # Prefer the parquet cache written on a previous boot: sub-100ms
+            # reload vs re-parsing the CSV on every restart.
+            if (os.path.exists(NUTRITION_PARQUET_PATH)
+                    and os.path.getmtime(NUTRITION_PARQUET_PATH) >= os.path.getmtime(NUTRITION_DATA_PATH)):
+                self.nutrition_df = pd.read_parquet(NUTRITION_PARQUET_PATH)
+            else:
+                try:
+                    self.nutrition_df = pd.read_csv(NUTRITION_DATA_PATH, engine='pyarrow', dtype=NUTRITION_DTYPES)
+                except (ValueError, TypeError):
+                    # Malformed values: fall back to the permissive parse.
+                    self.nutrition_df = pd.read_csv(NUTRITION_DATA_PATH)
+                    for col in nutritional_cols:
+                        self.nutrition_df[col] = pd.to_numeric(self.nutrition_df[col], errors='coerce')
+                try:
+                    self.nutrition_df.to_parquet(NUTRITION_PARQUET_PATH)
+                except Exception:
+                    pass  # the cache is best-effort
+            self.nutrition_df['Food_Item_Lower'] = self.nutrition_df['Food_Item'].str.lower().str.strip()
             self.nutrition_df.dropna(subset=nutritional_cols, inplace=True)
-            self.food_list_for_fuzzy_search = self.nutrition_df['Food_Item_Lower'].tolist()
+            # Tuple of pre-normalized names so RapidFuzz can skip its default
+            # preprocessing (processor=None) on every call.
+            self.food_list_for_fuzzy_search = tuple(self.nutrition_df['Food_Item_Lower'])
+            # Fully canonical forms for fuzzy matching; indices line up with
+            # food_list_for_fuzzy_search so matches map back to DB keys.
+            self.food_names_norm = tuple(s.replace('_', ' ') for s in self.food_list_for_fuzzy_search)
+            # O(1) exact-match lookups, so hot endpoints never scan the DataFrame.
+            self.nutrition_index = {
+                row.Food_Item_Lower: (row.Calories, row.Protein_g, row.Fat_g, row.Carbs_g)
+                for row in self.nutrition_df.itertuples(index=False)
+            }
+            # Structure-of-arrays view: name -> int id plus one contiguous
+            # float32 array per nutrient, so meal totals vectorize in NumPy.
+            self.food_id = {name: i for i, name in enumerate(self.nutrition_df['Food_Item_Lower'])}
+            self.cal_arr = self.nutrition_df['Calories'].to_numpy(dtype=np.float32)
+            self.prot_arr = self.nutrition_df['Protein_g'].to_numpy(dtype=np.float32)
+            self.fat_arr = self.nutrition_df['Fat_g'].to_numpy(dtype=np.float32)
+            self.carb_arr = self.nutrition_df['Carbs_g'].to_numpy(dtype=np.float32)
             print("✅ Nutrition database loaded successfully.")
         except FileNotFoundError:
             print(f"❌ FATAL ERROR: Nutrition database not found at '{NUTRITION_DATA_PATH}'.")
 
-        if pipeline and os.path.isdir(TINYLLAMA_MODEL):
+        if AutoModelForCausalLM and os.path.isdir(TINYLLAMA_MODEL):
             try:
-                device_map = "auto" if torch.cuda.is_available() else "cpu"
-                torch_dtype = torch.bfloat16 if torch.cuda.is_available() else torch.float32
-                self.text_generator = pipeline("text-generation", model=TINYLLAMA_MODEL, torch_dtype=torch_dtype, device_map=device_map)
+                if torch.cuda.is_available():
+                    # NF4 weights halve HBM traffic per decoded token vs FP16,
+                    # the bottleneck for a decode-bound model this small.
+                    quant_config = BitsAndBytesConfig(
+                        load_in_4bit=True,
+                        bnb_4bit_compute_dtype=torch.float16,
+                        bnb_4bit_quant_type="nf4",
+                    )
+                    self.text_model = AutoModelForCausalLM.from_pretrained(TINYLLAMA_MODEL, quantization_config=quant_config, device_map="auto")
+                else:
+                    # bitsandbytes is GPU-only; stay FP32 on CPU.
+                    self.text_model = AutoModelForCausalLM.from_pretrained(TINYLLAMA_MODEL, torch_dtype=torch.float32)
+                self.text_tokenizer = AutoTokenizer.from_pretrained(TINYLLAMA_MODEL)
+                self._tip_prefix_kv = self._prefill_prefix(DAILY_TIP_PROMPT)
+                self._summary_prefix_kv = self._prefill_prefix(SUMMARY_PREFIX)
                 print(f"✅ TinyLlama model loaded successfully from: {TINYLLAMA_MODEL}")
             except Exception as e:
                 print(f"❌ FATAL ERROR: Could not load TinyLlama model. Details: {e}")
         else:
             print(f"⚠️ WARNING: Fine-tuned text model not found at '{TINYLLAMA_MODEL}'.")
 
+    def _prefill_prefix(self, prefix):
+        """Run a constant prompt prefix through the model once and keep its
+        KV cache; per-request prefill then only covers the suffix."""
+        ids = self.text_tokenizer(prefix, return_tensors="pt").input_ids.to(self.text_model.device)
+        if ids.shape[1] <= 1:
+            return None
+        # Stop one token short: generate() requires at least one unprocessed
+        # prompt token, and for /get_daily_tip the prompt IS the prefix — a
+        # full-prompt cache makes transformers feed an empty cache_position
+        # and crash in _update_causal_mask.
+        with torch.no_grad():
+            return self.text_model(ids[:, :-1], use_cache=True).past_key_values
+
+    def generate_text(self, prompt, prefix_kv=None, **gen_kwargs):
+        """Direct generate() call that reuses a precomputed prefix KV cache
+        and returns only the newly generated completion."""
+        inputs = self.text_tokenizer(prompt, return_tensors="pt").to(self.text_model.device)
+        # generate() mutates the cache in place, so each request gets a copy.
+        past = copy.deepcopy(prefix_kv) if prefix_kv is not None else None
+        with torch.no_grad():
+            outputs = self.text_model.generate(
+                **inputs, past_key_values=past, use_cache=True,
+                eos_token_id=self.text_tokenizer.eos_token_id, **gen_kwargs
+            )
+        # Slice off the prompt at the token level instead of decoding the
+        # whole sequence and searching it for the assistant marker.
+        new_tokens = outputs[0, inputs['input_ids'].shape[1]:]
+        return self.text_tokenizer.decode(new_tokens, skip_special_tokens=True)
+
+
+# Created in the startup hook so each uvicorn worker loads the weights once
+# in its own process, not at module import.
+ai = None
+
+# Micro-batching for /analyze_image: concurrent requests are collected for up
+# to VIT_MAX_DELAY seconds and classified in one forward pass, amortizing the
+# fixed per-batch launch cost.
+VIT_MAX_BATCH = 8
+VIT_MAX_DELAY = 0.010
+
+_vit_queue: asyncio.Queue = asyncio.Queue()
+
+async def _vit_batch_worker():
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await _vit_queue.get()]
+        deadline = loop.time() + VIT_MAX_DELAY
+        while len(batch) < VIT_MAX_BATCH:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(_vit_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        images = [img for img, _ in batch]
+        try:
+            async with ai._gpu_sem:
+                # Without an explicit batch_size the HF pipeline forwards
+                # list items one by one; pass it so the model actually sees
+                # one batched forward.
+                results = await run_in_threadpool(ai.vit_classifier, images, batch_size=len(images))
+            for (_, future), predictions in zip(batch, results):
+                # A disconnected client cancels its future; setting a result
+                # on it would raise and fail the rest of the batch.
+                if not future.done():
+                    future.set_result(predictions)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
 
-ai = AIModels()
+def _vit_worker_done(task):
+    if not task.cancelled():
+        print(f"⚠️ WARNING: ViT batch worker exited unexpectedly: {task.exception()}")
+
+@app.on_event("startup")
+async def startup():
+    global ai
+    ai = AIModels()
+    # Warm the in-process history cache; reads re-sync it when the file grows.
+    sync_meal_log_cache()
+    # Keep a strong reference: the loop only holds tasks weakly, and a
+    # collected worker would leave every /analyze_image future unresolved.
+    app.state.vit_worker = asyncio.create_task(_vit_batch_worker())
+    app.state.vit_worker.add_done_callback(_vit_worker_done)
 
 # --- 4. Helper Functions ---
+@functools.lru_cache(maxsize=4096)
+def _normalize(name: str) -> str:
+    """Canonical form used at request ingress; cached since users keep
+    typing the same handful of foods."""
+    return name.lower().strip().replace('_', ' ')
+
 def find_food_in_db_fuzzy(food_name: str, threshold=85):
     """Performs a fuzzy search with a configurable threshold."""
     if ai.nutrition_df is None or not food_name: return None
-    
-    normalized_name = food_name.lower().strip().replace('_', ' ')
-    best_match, score = fuzzy_process.extractOne(normalized_name, ai.food_list_for_fuzzy_search)
-    
-    if score >= threshold:
-        food_data = ai.nutrition_df[ai.nutrition_df['Food_Item_Lower'] == best_match].iloc[0]
-        return food_data
+
+    match = fuzzy_process.extractOne(
+        _normalize(food_name), ai.food_names_norm,
+        scorer=fuzz.WRatio, processor=None, score_cutoff=threshold
+    )
+
+    if match:
+        best_match = ai.food_list_for_fuzzy_search[match[2]]
+        return ai.nutrition_index.get(best_match)
     return None
 
 def get_log(file_path):
     try:
-        with open(file_path, 'r') as f: return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError): return []
+        with open(file_path, 'rb') as f:
+            return [orjson.loads(line) for line in f if line.strip()]
+    except (FileNotFoundError, orjson.JSONDecodeError): return []
+
+def tail_log(file_path, limit):
+    """Last `limit` entries without holding the whole history in memory."""
+    try:
+        with open(file_path, 'rb') as f:
+            lines = deque((line for line in f if line.strip()), maxlen=limit)
+        return [orjson.loads(line) for line in lines]
+    except (FileNotFoundError, orjson.JSONDecodeError): return []
+
+async def save_log(file_path, entry):
+    # O(1) append instead of rewriting the whole history on every request.
+    async with aiofiles.open(file_path, 'ab') as f:
+        await f.write(orjson.dumps(entry) + b'\n')
+    if file_path == MEAL_LOG_FILE:
+        ai.meal_log_cache.append(entry)
+        try:
+            ai._meal_log_size = os.path.getsize(MEAL_LOG_FILE)
+        except OSError:
+            ai._meal_log_size = -1
+
+def sync_meal_log_cache():
+    """Reload the in-memory history if the file grew behind our back.
 
-def save_log(file_path, entry):
-    log = get_log(file_path)
-    log.append(entry)
-    with open(file_path, 'w') as f: json.dump(log, f, indent=4)
+    With several uvicorn workers each process has its own cache; comparing
+    the file size before reads keeps them all consistent with the JSONL."""
+    try:
+        size = os.path.getsize(MEAL_LOG_FILE)
+    except OSError:
+        size = 0
+    if size != ai._meal_log_size:
+        ai.meal_log_cache = get_log(MEAL_LOG_FILE)
+        ai._meal_log_size = size
 
 # --- 5. Pydantic Models ---
 class AskAIRequest(BaseModel): prompt: str
@@ -134,12 +461,20 @@ class LogMealRequest(BaseModel):
 
 
 # --- 6. API Endpoints ---
+# One tip per day is enough; later requests the same day skip generation.
+_tip_cache = None
+
 @app.get("/get_daily_tip")
 async def get_daily_tip_endpoint():
-    if not ai.text_generator: return {"tip": "Welcome!"}
-    prompt = "<|system|>You are a friendly health assistant. Provide a single, actionable, positive health tip. Keep it short.</s><|user|>Give me a simple health tip for today.</s><|assistant|>"
-    sequences = ai.text_generator(prompt, max_new_tokens=70, do_sample=True, temperature=0.8)
-    tip = sequences[0]['generated_text'].split("<|assistant|>")[1].strip()
+    global _tip_cache
+    if not ai.text_model: return {"tip": "Welcome!"}
+    if _tip_cache and _tip_cache[0] == date.today():
+        return {"tip": _tip_cache[1]}
+    # Greedy decoding: the fixed prompt does not benefit from sampling.
+    async with ai._gpu_sem:
+        text = await run_in_threadpool(ai.generate_text, DAILY_TIP_PROMPT, prefix_kv=ai._tip_prefix_kv, max_new_tokens=70, do_sample=False)
+    tip = text.strip()
+    _tip_cache = (date.today(), tip)
     return {"tip": tip}
 
 @app.post("/analyze_image")
@@ -147,8 +482,12 @@ async def analyze_image_endpoint(image: UploadFile = File(...)):
     if not ai.vit_classifier:
         raise HTTPException(status_code=503, detail="Image analysis model is not available.")
     try:
-        img = Image.open(image.file)
-        predictions = ai.vit_classifier(img)
+        # Resize once at ingress (SIMD-accelerated under Pillow-SIMD) so the
+        # processor's pure-Python resize branch is a no-op on large uploads.
+        img = Image.open(image.file).convert('RGB').resize((224, 224), Image.BILINEAR)
+        future = asyncio.get_running_loop().create_future()
+        await _vit_queue.put((img, future))
+        predictions = await future
         food_name = predictions[0]['label'].replace('_', ' ')
         return {"food_name": food_name}
     except Exception as e:
@@ -160,31 +499,35 @@ async def suggest_food_endpoint(request: SuggestionRequest):
     if ai.nutrition_df is None or not request.food_name:
         raise HTTPException(status_code=400, detail="Food name is required.")
     
-    suggestions = fuzzy_process.extract(request.food_name.lower(), ai.food_list_for_fuzzy_search, limit=4)
-    high_confidence_suggestions = [s[0] for s in suggestions if s[1] >= 75]
+    suggestions = await run_in_threadpool(
+        fuzzy_process.extract,
+        _normalize(request.food_name), ai.food_names_norm,
+        scorer=fuzz.WRatio, processor=None, limit=4, score_cutoff=75
+    )
+    high_confidence_suggestions = [s[0] for s in suggestions]
     
     return {"suggestions": high_confidence_suggestions}
 
 @app.post("/log_meal")
 async def log_meal_endpoint(request: LogMealRequest):
-    total_calories, total_protein, total_fat, total_carbs = 0, 0, 0, 0
-    
+    id_list, qty_list = [], []
     for item in request.meal_items:
-        food_name = item.get("item")
-        quantity = float(item.get("quantity", 1))
-        
-        result = ai.nutrition_df[ai.nutrition_df['Food_Item_Lower'] == food_name.lower()]
-        if not result.empty:
-            food_data = result.iloc[0]
-            total_calories += food_data['Calories'] * quantity
-            total_protein += food_data['Protein_g'] * quantity
-            total_fat += food_data['Fat_g'] * quantity
-            total_carbs += food_data['Carbs_g'] * quantity
+        food_id = ai.food_id.get(_normalize(item.get("item", "")))
+        if food_id is not None:
+            id_list.append(food_id)
+            qty_list.append(float(item.get("quantity", 1)))
+
+    ids = np.asarray(id_list, dtype=np.int32)
+    qty = np.asarray(qty_list, dtype=np.float32)
+    total_calories = float((ai.cal_arr[ids] * qty).sum())
+    total_protein = float((ai.prot_arr[ids] * qty).sum())
+    total_fat = float((ai.fat_arr[ids] * qty).sum())
+    total_carbs = float((ai.carb_arr[ids] * qty).sum())
     
     advice = f"Logged {len(request.meal_items)} items for a total of {total_calories:.0f} calories. Well done!"
 
     if not request.quick_check:
-        save_log(MEAL_LOG_FILE, {
+        await save_log(MEAL_LOG_FILE, {
             "timestamp": datetime.now().isoformat(), "food_name": request.image_food_name,
             "total_calories": total_calories, "total_protein": total_protein,
             "total_fat": total_fat, "total_carbs": total_carbs, "advice": advice
@@ -199,33 +542,33 @@ async def log_meal_endpoint(request: LogMealRequest):
 
 
 @app.get("/get_meal_history")
-async def get_meal_history_endpoint():
-    return get_log(MEAL_LOG_FILE)
+async def get_meal_history_endpoint(request: Request):
+    sync_meal_log_cache()
+    etag = hashlib.blake2b(str(len(ai.meal_log_cache)).encode()).hexdigest()
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304)
+    return ORJSONResponse(content=ai.meal_log_cache, headers={"ETag": etag})
 
 @app.post("/get_ai_summary")
 async def get_ai_summary_endpoint(request: AskAIRequest):
-    if not ai.text_generator:
+    if not ai.text_model:
         raise HTTPException(status_code=503, detail="AI Assistant is currently unavailable.")
-    meal_history = get_log(MEAL_LOG_FILE)
+    meal_history = tail_log(MEAL_LOG_FILE, 30)
     if not meal_history:
         return {"answer": "Your meal history is empty. Log a few meals to get a summary!"}
-    history_context = "\n".join([f"- {datetime.fromisoformat(m['timestamp']).strftime('%Y-%m-%d')}: {m['food_name']} ({m.get('total_calories', 0):.0f} kcal)" for m in meal_history[-30:]])
-    prompt_template = f"""
-    <|system|>
-    You are NutriGuide, a friendly AI nutritionist. Analyze the user's meal history and provide a helpful summary. Look for patterns, provide at least two clear, actionable suggestions. Be positive and conversational. Speak directly to the user.</s>
-    <|user|>
-    My recent meal history:
-    {history_context}
+    history_context = "\n".join([f"- {datetime.fromisoformat(m['timestamp']).strftime('%Y-%m-%d')}: {m['food_name']} ({m.get('total_calories', 0):.0f} kcal)" for m in meal_history])
+    prompt_template = SUMMARY_PREFIX + f"""    {history_context}
     Please give me a summary of my diet and some suggestions. My original prompt was: "{request.prompt}"</s>
     <|assistant|>
     """
-    sequences = ai.text_generator(prompt_template, max_new_tokens=500, do_sample=True, temperature=0.75)
-    answer = sequences[0]['generated_text'].split("<|assistant|>")[1].strip()
+    async with ai._gpu_sem:
+        text = await run_in_threadpool(ai.generate_text, prompt_template, prefix_kv=ai._summary_prefix_kv, max_new_tokens=500, do_sample=True, temperature=0.75)
+    answer = text.strip()
     return {"answer": answer}
 
 @app.post("/log_feedback")
 async def log_feedback_endpoint(feedback: FeedbackRequest):
-    save_log(FEEDBACK_LOG_FILE, {
+    await save_log(FEEDBACK_LOG_FILE, {
         "timestamp": datetime.now().isoformat(),
         "original_guess": feedback.original_guess,
         "user_correction": feedback.user_correction,
@@ -235,19 +578,33 @@ async def log_feedback_endpoint(feedback: FeedbackRequest):
 
 @app.get("/export_history")
 async def export_history_endpoint():
-    meal_history = get_log(MEAL_LOG_FILE)
-    if not meal_history:
+    sync_meal_log_cache()
+    if not ai.meal_log_cache:
         raise HTTPException(status_code=404, detail="No meal history available.")
-    df = pd.DataFrame(meal_history)
     expected_cols = ['timestamp', 'food_name', 'quantity', 'total_calories', 'total_protein', 'total_fat', 'total_carbs', 'advice']
-    for col in expected_cols:
-        if col not in df.columns: df[col] = 'N/A'
-    df = df[expected_cols] 
-    stream = io.StringIO()
-    df.to_csv(stream, index=False)
-    response = StreamingResponse(iter([stream.getvalue()]), media_type="text/csv")
+
+    async def generate_csv():
+        # Stream row by row through one reusable buffer: constant memory
+        # regardless of history size, no DataFrame construction.
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(expected_cols)
+        yield buf.getvalue()
+        for entry in ai.meal_log_cache:
+            buf.seek(0); buf.truncate()
+            writer.writerow([entry.get(col, 'N/A') for col in expected_cols])
+            yield buf.getvalue()
+
+    response = StreamingResponse(generate_csv(), media_type="text/csv")
     response.headers["Content-Disposition"] = f"attachment; filename=nutriguide_history_{datetime.now().strftime('%Y-%m-%d')}.csv"
     return response
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    if "--export-vit" in sys.argv:
+        export_vit_int8_onnx()
+    else:
+        # One worker per core for CPU deployments; a single worker on GPU so
+        # the model weights are not duplicated in VRAM.
+        workers = 1 if torch.cuda.is_available() else os.cpu_count()
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=workers,
+                    loop="uvloop", http="httptools", reload=False)